@@ -3,12 +3,12 @@ import json
 with open('data.json', 'r', encoding='utf-8') as f:
     data = json.load(f)
 
+OLD_PREFIX = '/gpfs/radev/pi/q_chen/zq65/Research/Data/DermDPO/datasets/eval/SCIN/images/'
+NEW_PREFIX = 'images/SCIN/images/'
+
 for case in data:
-    new_image_paths = []
-    for path in case['image_paths']:
-        new_path = path.replace('/gpfs/radev/pi/q_chen/zq65/Research/Data/DermDPO/datasets/eval/SCIN/images/', 'images/SCIN/images/')
-        new_image_paths.append(new_path)
-    case['image_paths'] = new_image_paths
+    # 与原逻辑一致：路径中任意位置出现的旧前缀都替换
+    case['image_paths'] = [path.replace(OLD_PREFIX, NEW_PREFIX) for path in case['image_paths']]
 
 
 with open('data_modified.json', 'w', encoding='utf-8') as f:
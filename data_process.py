@@ -1,53 +1,145 @@
-import json
+import math
 import random
 import re
 import os
-from typing import List, Dict, Tuple, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Tuple, Optional, Union
 import numpy as np
 from datetime import datetime
 
+from json_io import load_json, dump_json, dumps_json, iter_json_items
 
+
+def load_json_cached(path: str):
+    """
+    读取JSON文件并按 (路径, 修改时间) 缓存，重复调用时跳过解析
+    文件被修改后自动重新读取；返回的对象在多次调用间共享，调用方不应修改
+    """
+    return _load_json_cached(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _load_json_cached(path: str, mtime_ns: int):
+    """load_json_cached 的缓存实现"""
+    return load_json(path)
+
+
+def dump_json_array(items, path: str) -> None:
+    """
+    逐条写出JSON数组，同一时间只有一个元素的序列化结果驻留内存
+    输出与 dump_json(list(items), path) 完全一致
+    """
+    with open(path, 'wb') as f:
+        first = True
+        for item in items:
+            f.write(b'[\n  ' if first else b',\n  ')
+            first = False
+            # JSON字符串内的换行均已转义，可直接为每行增加一级缩进
+            f.write(dumps_json(item).replace(b'\n', b'\n  '))
+        f.write(b'[]' if first else b'\n]')
+
+
+def iter_per_sample_results(eval_file: str):
+    """逐条读取评估文件中的 per_sample_results (安装了 ijson 时流式解析)"""
+    return iter_json_items(eval_file, 'per_sample_results.item')
+
+
+# process_evaluation_data 实际用到的样本字段
+EVAL_SAMPLE_FIELDS = ('id', 'case_id', 'pmid', 'predicted_differential',
+                      'ground_truth_differential', 'predicted_differential_text')
+
+
+def project_eval_sample(sample: Dict) -> Dict:
+    """
+    只保留处理所需的样本字段
+    strict_metrics 等未使用的内容不会随样本一起保留在内存中
+    """
+    slim = {k: sample[k] for k in EVAL_SAMPLE_FIELDS if k in sample}
+    dermlip_metrics = sample.get('dermlip_metrics')
+    if isinstance(dermlip_metrics, dict) and 'similarity_matrix' in dermlip_metrics:
+        slim['dermlip_metrics'] = {'similarity_matrix': dermlip_metrics['similarity_matrix']}
+    return slim
+
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=65536)
 def normalize_diagnosis(diag: str) -> str:
-    """标准化诊断名称，用于匹配"""
+    """标准化诊断名称，用于匹配 (结果按原字符串缓存)"""
     if not diag:
         return ""
     # 转小写，去除标点和多余空格
     diag = diag.lower().strip()
-    diag = re.sub(r'[^\w\s]', ' ', diag)
-    diag = re.sub(r'\s+', ' ', diag)
+    diag = _PUNCT_RE.sub(' ', diag)
+    diag = _WHITESPACE_RE.sub(' ', diag)
     return diag
 
 
-def replace_path_prefix(image_paths: List[str]) -> List[str]:
+# 词 -> 位序号，按首次出现的顺序分配
+_TOKEN_BITS: Dict[str, int] = {}
+
+
+@lru_cache(maxsize=100_000)
+def diagnosis_bits(normalized: str) -> int:
+    """
+    标准化诊断的词集合位图，跨病例缓存
+    每个词对应一位，交集/并集变为整数位运算，集合大小即 bit_count()
+    """
+    mask = 0
+    for token in normalized.split():
+        mask |= 1 << _TOKEN_BITS.setdefault(token, len(_TOKEN_BITS))
+    return mask
+
+
+def as_diagnosis_list(value) -> List[str]:
+    """
+    将鉴别诊断字段统一为列表
+    列表原样返回；"A | B" 形式的字符串按 | 拆分；其他类型返回空列表
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [d for d in map(str.strip, value.split('|')) if d]
+    return []
+
+
+IMAGE_PATH_OLD_PREFIX = "/gpfs/radev/pi/q_chen/zq65/Research/Data/DermDPO/datasets/eval/"
+IMAGE_PATH_NEW_PREFIX = "images/"
+_IMAGE_PATH_PREFIX_LEN = len(IMAGE_PATH_OLD_PREFIX)
+
+
+def replace_path_prefix(image_paths: List[str]) -> Tuple[List[str], int]:
     """
     替换图片路径前缀
     将 /gpfs/radev/pi/q_chen/zq65/Research/Data/DermDPO/datasets/eval/ 替换为 images/
+    返回 (替换后的路径列表, 被替换的路径数)
     """
-    old_prefix = "/gpfs/radev/pi/q_chen/zq65/Research/Data/DermDPO/datasets/eval/"
-    new_prefix = "images/"
-    
-    replaced_paths = []
-    replaced_count = 0
-    for path in image_paths:
-        if path.startswith(old_prefix):
-            # 替换前缀
-            new_path = new_prefix + path[len(old_prefix):]
-            replaced_paths.append(new_path)
-            replaced_count += 1
-        else:
-            # 如果不是目标前缀，保持原样
-            replaced_paths.append(path)
+    # 不是目标前缀的路径保持原样
+    replaced_paths = [
+        IMAGE_PATH_NEW_PREFIX + path[_IMAGE_PATH_PREFIX_LEN:] if path.startswith(IMAGE_PATH_OLD_PREFIX) else path
+        for path in image_paths
+    ]
+    replaced_count = sum(1 for path in image_paths if path.startswith(IMAGE_PATH_OLD_PREFIX))
     
     return replaced_paths, replaced_count
 
 
+@lru_cache(maxsize=200_000)
 def diagnoses_match(diag1: str, diag2: str, threshold: float = 0.8) -> bool:
     """
     判断两个诊断是否匹配
     使用多种策略:完全匹配、包含关系、词汇重叠
+    结果按 (diag1, diag2, threshold) 缓存，不同病例间重复出现的GT对只计算一次
     """
     if not diag1 or not diag2:
         return False
+    # 原始字符串相同则标准化后也相同，直接返回
+    if diag1 == diag2:
+        return True
     
     d1 = normalize_diagnosis(diag1)
     d2 = normalize_diagnosis(diag2)
@@ -56,58 +148,65 @@ def diagnoses_match(diag1: str, diag2: str, threshold: float = 0.8) -> bool:
     if d1 == d2:
         return True
     
-    # 包含关系(长度相近)
-    if d1 in d2 or d2 in d1:
-        len_ratio = min(len(d1), len(d2)) / max(len(d1), len(d2))
-        if len_ratio > threshold:
-            return True
+    # 包含关系(长度相近)：先比较长度，长度差距过大时不必做子串查找
+    l1, l2 = len(d1), len(d2)
+    if l1 > l2:
+        l1, l2 = l2, l1
+    if l1 / l2 > threshold and (d1 in d2 or d2 in d1):
+        return True
     
-    # 词汇重叠度
-    words1 = set(d1.split())
-    words2 = set(d2.split())
-    if words1 and words2:
-        overlap = len(words1.intersection(words2)) / len(words1.union(words2))
+    # 词汇重叠度：没有共同词时直接判为不匹配，不再计算并集
+    bits1 = diagnosis_bits(d1)
+    bits2 = diagnosis_bits(d2)
+    common = bits1 & bits2
+    if common:
+        overlap = common.bit_count() / (bits1 | bits2).bit_count()
         if overlap > threshold:
             return True
     
     return False
 
 
+@lru_cache(maxsize=200_000)
 def are_diagnoses_same(diag1: str, diag2: str, similarity_threshold: float = 0.9) -> bool:
     """
     判断两个诊断是否实质上相同
-    用于过滤掉 predicted 和 ground_truth 相同的配对
+    用于过滤掉 predicted 和 ground_truth 相同的配对 (结果按参数缓存)
     """
     if not diag1 or not diag2:
         return False
+    # 原始字符串相同则标准化后也相同，直接返回
+    if diag1 == diag2:
+        return True
     
     d1 = normalize_diagnosis(diag1)
     d2 = normalize_diagnosis(diag2)
-    
+    return _normalized_diagnoses_same(d1, d2, diagnosis_bits(d1), diagnosis_bits(d2), similarity_threshold)
+
+
+def _normalized_diagnoses_same(d1: str, d2: str, bits1: int, bits2: int,
+                               similarity_threshold: float) -> bool:
+    """are_diagnoses_same 的核心判断，输入为已标准化的诊断及其词集合位图"""
     # 完全相同
     if d1 == d2:
         return True
     
-    # 计算 Jaccard 相似度
-    words1 = set(d1.split())
-    words2 = set(d2.split())
-    
-    if not words1 or not words2:
+    if not bits1 or not bits2:
         return False
     
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
-    jaccard = intersection / union if union > 0 else 0.0
+    # 计算 Jaccard 相似度
+    jaccard = jaccard_from_bits(bits1, bits2)
     
     # 如果相似度很高，认为是相同的
     if jaccard >= similarity_threshold:
         return True
     
-    # 检查包含关系（几乎完全包含）
-    if d1 in d2 or d2 in d1:
-        len_ratio = min(len(d1), len(d2)) / max(len(d1), len(d2))
-        if len_ratio > similarity_threshold:
-            return True
+    # 检查包含关系（几乎完全包含）：先比较长度，再做子串查找
+    l1, l2 = len(d1), len(d2)
+    if l1 > l2:
+        l1, l2 = l2, l1
+    if l1 / l2 > similarity_threshold and (d1 in d2 or d2 in d1):
+        return True
     
     return False
 
@@ -128,33 +227,28 @@ def has_high_content_overlap(diag1: str, diag2: str, overlap_threshold: float =
     if not diag1 or not diag2:
         return False
     
-    d1 = normalize_diagnosis(diag1)
-    d2 = normalize_diagnosis(diag2)
-    
-    words1 = set(d1.split())
-    words2 = set(d2.split())
-    
-    if not words1 or not words2:
+    bits1 = diagnosis_bits(normalize_diagnosis(diag1))
+    bits2 = diagnosis_bits(normalize_diagnosis(diag2))
+    return _word_bits_overlap(bits1, bits2, overlap_threshold)
+
+
+def _word_bits_overlap(bits1: int, bits2: int, overlap_threshold: float) -> bool:
+    """has_high_content_overlap 的核心判断，输入为两个诊断的词集合位图"""
+    if not bits1 or not bits2:
         return False
     
     # 计算 Jaccard 相似度
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
-    jaccard = intersection / union if union > 0 else 0.0
+    jaccard = jaccard_from_bits(bits1, bits2)
     
     # 检查重复度
     if jaccard >= overlap_threshold:
         return True
     
     # 检查包含关系：如果一个诊断的词汇被另一个几乎完全包含
-    if words1 and words2:
-        # 小集合在大集合中的占比
-        smaller = words1 if len(words1) <= len(words2) else words2
-        larger = words2 if len(words1) <= len(words2) else words1
-        
-        overlap_ratio = len(smaller.intersection(larger)) / len(smaller)
-        if overlap_ratio >= overlap_threshold:
-            return True
+    # 小集合在大集合中的占比
+    overlap_ratio = (bits1 & bits2).bit_count() / min(bits1.bit_count(), bits2.bit_count())
+    if overlap_ratio >= overlap_threshold:
+        return True
     
     return False
 
@@ -172,17 +266,14 @@ def normalize_similarities_in_case(all_pairs: List[Dict]) -> List[Dict]:
     if not all_pairs:
         return all_pairs
     
-    # 提取所有相似度值
+    # 提取所有相似度值 (min/max 均为 C 实现的单次遍历)
     similarities = [pair['similarity'] for pair in all_pairs]
-    
-    if not similarities:
-        return all_pairs
-    
     min_sim = min(similarities)
     max_sim = max(similarities)
+    sim_span = max_sim - min_sim
     
     # 如果最大值和最小值相同，所有相似度都设为 0.5
-    if max_sim - min_sim < 1e-6:
+    if sim_span < 1e-6:
         for pair in all_pairs:
             pair['similarity_normalized'] = 0.5
             pair['similarity_original'] = pair['similarity']
@@ -191,18 +282,130 @@ def normalize_similarities_in_case(all_pairs: List[Dict]) -> List[Dict]:
     # Min-Max 归一化到 [0, 1]
     for pair in all_pairs:
         original_sim = pair['similarity']
-        normalized_sim = (original_sim - min_sim) / (max_sim - min_sim)
-        pair['similarity_normalized'] = round(normalized_sim, 4)
+        normalized_sim = round((original_sim - min_sim) / sim_span, 4)
+        pair['similarity_normalized'] = normalized_sim
         pair['similarity_original'] = original_sim
-        pair['similarity'] = pair['similarity_normalized']  # 使用归一化后的值
+        pair['similarity'] = normalized_sim  # 使用归一化后的值
     
     return all_pairs
 
 
-def match_case_by_gt(case_eval: Dict, medical_data: List[Dict], debug=False) -> Optional[Dict]:
+def _char_trigrams(text: str) -> set:
+    """字符串的所有字符三元组(含空格)"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def prepare_medical_gt(medical_data: List[Dict]) -> Dict:
+    """
+    预先提取并标准化 medical_data 各条目的GT标签，并建立倒排索引
+    每个条目只处理一次，结果可供所有评估样本的匹配复用
+    
+    Returns:
+        entries: [(med_item, 标准化后的GT列表), ...]
+        tokens: 词 -> 含该词的条目序号集合
+        trigrams: 字符三元组 -> 含该三元组的条目序号集合
+        key_trigrams: 每个GT中最罕见的三元组 -> 条目序号集合
+        short: 含过短(<3字符)GT的条目序号集合，三元组无法覆盖，始终作为候选
+        token_df / trigram_df: 词/三元组的文档频率，用于查询时挑选最罕见的键
+    """
+    entries = []
+    gt_texts = []
+    for med_item in medical_data:
+        # 提取medical_data的GT
+        med_gt = med_item.get('GT', {})
+        med_gt_list = [v for k, v in med_gt.items() if k.startswith('label_')]
+        
+        if not med_gt_list:
+            continue
+        
+        # 标准化medical_data的GT
+        med_gt_normalized = [normalize_diagnosis(gt) for gt in med_gt_list]
+        entries.append((med_item, med_gt_normalized))
+        # diagnoses_match 内部会再标准化一次，索引使用与之相同的字符串
+        gt_texts.append([normalize_diagnosis(gt) for gt in med_gt_normalized if gt])
+    
+    tokens = {}
+    trigrams = {}
+    short = set()
+    for pos, texts in enumerate(gt_texts):
+        for text in texts:
+            for token in text.split():
+                tokens.setdefault(token, set()).add(pos)
+            if len(text) < 3:
+                short.add(pos)
+            for gram in _char_trigrams(text):
+                trigrams.setdefault(gram, set()).add(pos)
+    
+    token_df = {token: len(p) for token, p in tokens.items()}
+    trigram_df = {gram: len(p) for gram, p in trigrams.items()}
+    
+    key_trigrams = {}
+    for pos, texts in enumerate(gt_texts):
+        for text in texts:
+            grams = _char_trigrams(text)
+            if grams:
+                key = min(grams, key=lambda g: (trigram_df[g], g))
+                key_trigrams.setdefault(key, set()).add(pos)
+    
+    return {
+        'entries': entries,
+        'tokens': tokens,
+        'trigrams': trigrams,
+        'key_trigrams': key_trigrams,
+        'short': short,
+        'token_df': token_df,
+        'trigram_df': trigram_df,
+    }
+
+
+def _candidate_positions(eval_gt_normalized: List[str], medical_gt: Dict) -> Optional[set]:
+    """
+    找出可能与评估GT匹配的 medical 条目序号 (diagnoses_match, threshold=0.8)
+    只做必要条件过滤，结果是真实匹配条目的超集；返回 None 表示需要全量比较
+    
+    - 词 Jaccard > 0.8：两者必然共享评估GT中任意 n - floor(0.8n) 个词之一 (前缀过滤)
+    - 评估GT被包含：其所有三元组都出现在 medical GT 中，取最罕见的一个即可
+    - medical GT被包含：其最罕见的三元组必然出现在评估GT中
+    """
+    tokens = medical_gt['tokens']
+    trigrams = medical_gt['trigrams']
+    key_trigrams = medical_gt['key_trigrams']
+    token_df = medical_gt['token_df']
+    trigram_df = medical_gt['trigram_df']
+    
+    candidates = set(medical_gt['short'])
+    for eval_gt in eval_gt_normalized:
+        if not eval_gt:
+            continue
+        text = normalize_diagnosis(eval_gt)
+        if len(text) < 3:
+            return None
+        
+        words = sorted(set(text.split()), key=lambda w: (token_df.get(w, 0), w))
+        prefix_len = len(words) - (4 * len(words)) // 5
+        for word in words[:prefix_len]:
+            candidates.update(tokens.get(word, ()))
+        
+        grams = _char_trigrams(text)
+        rarest = min(grams, key=lambda g: (trigram_df.get(g, 0), g))
+        candidates.update(trigrams.get(rarest, ()))
+        for gram in grams:
+            candidates.update(key_trigrams.get(gram, ()))
+    return candidates
+
+
+def match_case_by_gt(
+    case_eval: Dict,
+    medical_data: List[Dict],
+    debug=False,
+    medical_gt: Optional[Dict] = None,
+    use_index: bool = True
+) -> Optional[Dict]:
     """
     通过ground_truth匹配病例
     返回匹配到的medical_data条目
+    medical_gt 为 prepare_medical_gt(medical_data) 的结果，批量匹配时应预先计算并传入
+    use_index=False 时不用倒排索引筛选，逐条比较全部条目 (用于核对索引筛选的结果)
     """
     eval_gt_list = case_eval.get('ground_truth_differential', [])
     if not eval_gt_list:
@@ -211,20 +414,19 @@ def match_case_by_gt(case_eval: Dict, medical_data: List[Dict], debug=False) ->
     # 标准化评估文件的GT
     eval_gt_normalized = [normalize_diagnosis(gt) for gt in eval_gt_list]
     
+    if medical_gt is None:
+        medical_gt = prepare_medical_gt(medical_data)
+    entries = medical_gt['entries']
+    
+    # 倒排索引筛选候选条目，按原顺序比较以保持相同的结果
+    candidates = _candidate_positions(eval_gt_normalized, medical_gt) if use_index else None
+    positions = range(len(entries)) if candidates is None else sorted(candidates)
+    
     best_match = None
     best_score = 0
     
-    for med_item in medical_data:
-        # 提取medical_data的GT
-        med_gt = med_item.get('GT', {})
-        med_gt_list = [v for k, v in med_gt.items() if k.startswith('label_')]
-        
-        if not med_gt_list:
-            continue
-        
-        # 标准化medical_data的GT
-        med_gt_normalized = [normalize_diagnosis(gt) for gt in med_gt_list]
-        
+    for pos in positions:
+        med_item, med_gt_normalized = entries[pos]
         # 计算匹配分数
         match_count = 0
         for eval_gt in eval_gt_normalized:
@@ -247,57 +449,139 @@ def match_case_by_gt(case_eval: Dict, medical_data: List[Dict], debug=False) ->
     return None
 
 
-def calculate_similarity_variance(task3_pairs: List[Dict]) -> float:
+def calculate_similarity_stats(task3_pairs: List[Dict]) -> Tuple[float, float]:
     """
-    计算task3_pairs中相似度的波动程度
-    返回标准差，波动越大值越高
+    一次遍历计算task3_pairs中相似度的波动程度
+    返回 (标准差, 极差)，少于两对时均为 0.0
     """
     if not task3_pairs or len(task3_pairs) < 2:
-        return 0.0
+        return 0.0, 0.0
     
     similarities = [pair.get('similarity', 0.0) for pair in task3_pairs]
-    
-    # 计算标准差
-    return float(np.std(similarities))
+    n = len(similarities)
+    value_range = max(similarities) - min(similarities)
+    
+    # 计算标准差：task3_pairs 通常只有 2 对，小列表直接用纯 Python 计算，
+    # 避免 np.std 的调用开销 (n < 8 时 numpy 也是顺序累加，结果逐位一致)
+    if n < 8:
+        mean = sum(similarities) / n
+        return math.sqrt(sum((x - mean) * (x - mean) for x in similarities) / n), value_range
+    return float(np.std(similarities)), value_range
+
+
+def calculate_similarity_variance(task3_pairs: List[Dict]) -> float:
+    """
+    计算task3_pairs中相似度的波动程度
+    返回标准差，波动越大值越高
+    """
+    return calculate_similarity_stats(task3_pairs)[0]
 
 
 def calculate_similarity_range(task3_pairs: List[Dict]) -> float:
     """
     计算task3_pairs中相似度的极差(最大值-最小值)
     """
-    if not task3_pairs or len(task3_pairs) < 2:
-        return 0.0
-    
-    similarities = [pair.get('similarity', 0.0) for pair in task3_pairs]
-    return max(similarities) - min(similarities)
+    return calculate_similarity_stats(task3_pairs)[1]
 
 
-def get_dermlip_similarity(similarity_matrix, pred_idx: int, truth_idx: int) -> float:
-    """从相似度矩阵中获取相似度分数"""
-    if similarity_matrix and len(similarity_matrix) > pred_idx:
-        if len(similarity_matrix[pred_idx]) > truth_idx:
-            return similarity_matrix[pred_idx][truth_idx]
-    return 0.0
+def to_similarity_array(similarity_matrix) -> Optional[np.ndarray]:
+    """
+    将相似度矩阵(嵌套列表)转换为二维 float64 数组
+    不规则的行用 NaN 补齐；空矩阵返回 None
+    """
+    if similarity_matrix is None or isinstance(similarity_matrix, np.ndarray):
+        return similarity_matrix
+    if not similarity_matrix:
+        return None
+    row_lens = [len(row) for row in similarity_matrix]
+    n_cols = max(row_lens)
+    if min(row_lens) == n_cols:
+        return np.asarray(similarity_matrix, dtype=np.float64)
+    sim_mat = np.full((len(similarity_matrix), n_cols), np.nan)
+    for i, row in enumerate(similarity_matrix):
+        sim_mat[i, :len(row)] = row
+    return sim_mat
+
+
+def get_dermlip_similarity(sim_mat: Optional[np.ndarray], pred_idx: int, truth_idx: int) -> Optional[float]:
+    """从相似度矩阵中获取相似度分数，越界或缺失时返回 None"""
+    if sim_mat is None:
+        return None
+    n_rows, n_cols = sim_mat.shape
+    # 显式检查上下界，负数索引不会被 NumPy 解释为从末尾取值
+    if not (0 <= pred_idx < n_rows and 0 <= truth_idx < n_cols):
+        return None
+    value = sim_mat[pred_idx, truth_idx]
+    if value != value:  # NaN: 不规则行补齐的位置
+        return None
+    return float(value)
+
+
+def jaccard_from_bits(bits1: int, bits2: int) -> float:
+    """计算两个词集合位图之间的Jaccard相似度"""
+    union = (bits1 | bits2).bit_count()
+    return (bits1 & bits2).bit_count() / union if union > 0 else 0.0
 
 
 def calculate_jaccard_similarity(diag1: str, diag2: str) -> float:
     """计算两个诊断之间的Jaccard相似度"""
-    words1 = set(normalize_diagnosis(diag1).split())
-    words2 = set(normalize_diagnosis(diag2).split())
+    # Jaccard 对称，按字典序排列参数后再查缓存
+    diag1, diag2 = diag1 or "", diag2 or ""
+    if diag2 < diag1:
+        diag1, diag2 = diag2, diag1
+    return _cached_jaccard_similarity(diag1, diag2)
+
+
+@lru_cache(maxsize=100_000)
+def _cached_jaccard_similarity(diag1: str, diag2: str) -> float:
+    """calculate_jaccard_similarity 的缓存实现"""
+    d1 = normalize_diagnosis(diag1)
+    d2 = normalize_diagnosis(diag2)
     
-    if len(words1) == 0 and len(words2) == 0:
+    # 快速路径: 完全相同，或字符掩码无交集(不可能有公共词)，无需构建集合
+    if d1 == d2:
+        return 1.0 if d1.strip() else 0.0
+    if not (_char_mask(d1) & _char_mask(d2)):
         return 0.0
     
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
-    
-    return intersection / union if union > 0 else 0.0
+    return jaccard_from_bits(diagnosis_bits(d1), diagnosis_bits(d2))
+
+
+@lru_cache(maxsize=100_000)
+def _char_mask(text: str) -> int:
+    """字符出现位图 (按码位低6位映射到64位整数)，用于快速排除无公共词的诊断"""
+    mask = 0
+    for c in text:
+        if c != ' ':
+            mask |= 1 << (ord(c) & 63)
+    return mask
+
+
+def build_pair_similarity_table(
+    sim_mat: Optional[np.ndarray],
+    pred_tok: List[int],
+    truth_tok: List[int]
+) -> List[List[float]]:
+    """
+    构建 pred×truth 的相似度表(嵌套列表)
+    优先取相似度矩阵中的值，越界或缺失(NaN)的位置用词集合 Jaccard 相似度(保留4位小数)补齐
+    """
+    table = np.full((len(pred_tok), len(truth_tok)), np.nan)
+    if sim_mat is not None:
+        n_rows = min(len(pred_tok), sim_mat.shape[0])
+        n_cols = min(len(truth_tok), sim_mat.shape[1])
+        table[:n_rows, :n_cols] = sim_mat[:n_rows, :n_cols]
+    
+    rows = table.tolist()
+    for i, j in np.argwhere(np.isnan(table)).tolist():
+        rows[i][j] = round(jaccard_from_bits(pred_tok[i], truth_tok[j]), 4)
+    return rows
 
 
 def generate_task3_pairs(
     pred_diff_list: List[str],
     truth_diff_list: List[str],
-    similarity_matrix: Optional[List[List[float]]] = None
+    similarity_matrix: Optional[np.ndarray] = None
 ) -> List[Dict]:
     """
     生成task3的两对诊断，优先选择相似度差异大的对
@@ -306,33 +590,42 @@ def generate_task3_pairs(
       - 对相似度进行归一化(0-1)
       - 保留原始相似度(similarity_original)
     """
+    similarity_matrix = to_similarity_array(similarity_matrix)
     if len(pred_diff_list) < 2 or len(truth_diff_list) < 2:
         return create_default_pairs(pred_diff_list, truth_diff_list, similarity_matrix)
     
+    # 整个矩阵一次性保留4位小数，配对时直接取值
+    if similarity_matrix is not None:
+        similarity_matrix = np.round(similarity_matrix, 4)
+    
+    # 每个诊断只做一次标准化和分词，配对循环中直接复用
+    pred_norm = [normalize_diagnosis(d) for d in pred_diff_list]
+    truth_norm = [normalize_diagnosis(d) for d in truth_diff_list]
+    pred_tok = [diagnosis_bits(d) for d in pred_norm]
+    truth_tok = [diagnosis_bits(d) for d in truth_norm]
+    
+    # 所有 pred×truth 的相似度一次算好
+    pair_sims = build_pair_similarity_table(similarity_matrix, pred_tok, truth_tok)
+    
     # 计算所有可能的配对及其相似度
     all_pairs = []
     for i, pred in enumerate(pred_diff_list):
         for j, truth in enumerate(truth_diff_list):
-            # 过滤1: 跳过实质相同的诊断
-            if are_diagnoses_same(pred, truth, similarity_threshold=0.85):
-                continue
+            if pred and truth:
+                # 过滤1: 跳过实质相同的诊断
+                if _normalized_diagnoses_same(pred_norm[i], truth_norm[j], pred_tok[i], truth_tok[j], 0.85):
+                    continue
 
-            # 过滤2: 跳过内容重复度过高的配对
-            if has_high_content_overlap(pred, truth, overlap_threshold=0.70):
-                continue
+                # 过滤2: 跳过内容重复度过高的配对
+                if _word_bits_overlap(pred_tok[i], truth_tok[j], 0.70):
+                    continue
 
-            # 相似度
-            if similarity_matrix and i < len(similarity_matrix) and j < len(similarity_matrix[i]):
-                similarity = similarity_matrix[i][j]
-            else:
-                similarity = calculate_jaccard_similarity(pred, truth)
-            
             all_pairs.append({
                 'pred_idx': i,
                 'truth_idx': j,
                 'predicted': pred,
                 'ground_truth': truth,
-                'similarity': round(similarity, 4)
+                'similarity': pair_sims[i][j]
             })
     
     # 若过滤后配对数量不足，宽松重试
@@ -340,20 +633,17 @@ def generate_task3_pairs(
         print(f"  警告: 过滤相同/重复诊断后配对不足 ({len(all_pairs)}个)，使用宽松策略")
         for i, pred in enumerate(pred_diff_list):
             for j, truth in enumerate(truth_diff_list):
-                if are_diagnoses_same(pred, truth, similarity_threshold=0.95):
-                    continue
-                if has_high_content_overlap(pred, truth, overlap_threshold=0.8):
-                    continue
-                if similarity_matrix and i < len(similarity_matrix) and j < len(similarity_matrix[i]):
-                    similarity = similarity_matrix[i][j]
-                else:
-                    similarity = calculate_jaccard_similarity(pred, truth)
+                if pred and truth:
+                    if _normalized_diagnoses_same(pred_norm[i], truth_norm[j], pred_tok[i], truth_tok[j], 0.95):
+                        continue
+                    if _word_bits_overlap(pred_tok[i], truth_tok[j], 0.8):
+                        continue
                 all_pairs.append({
                     'pred_idx': i,
                     'truth_idx': j,
                     'predicted': pred,
                     'ground_truth': truth,
-                    'similarity': round(similarity, 4)
+                    'similarity': pair_sims[i][j]
                 })
     
     # 若仍不足，使用默认对
@@ -363,25 +653,25 @@ def generate_task3_pairs(
     # 相似度归一化 (Min-Max)
     all_pairs = normalize_similarities_in_case(all_pairs)
 
-    # 策略：选择归一化后相似度差异最大的两对
-    best_variance = -1
-    best_pair_combo = None
+    # 策略：选择归一化后相似度差异最大的两对 (两对的 pred、truth 均不能重复)
+    # 在 n×n 矩阵上一次性计算所有组合，argmax 按行优先返回第一个最大值，与逐对比较的结果一致
+    n = len(all_pairs)
+    sims = np.array([pair['similarity'] for pair in all_pairs])
+    pred_ids = np.array([pair['pred_idx'] for pair in all_pairs])
+    truth_ids = np.array([pair['truth_idx'] for pair in all_pairs])
+    
+    valid = (np.triu(np.ones((n, n), dtype=bool), k=1)
+             & (pred_ids[:, None] != pred_ids[None, :])
+             & (truth_ids[:, None] != truth_ids[None, :]))
+    sim_diffs = np.where(valid, np.abs(sims[:, None] - sims[None, :]), -1.0)
+    best = int(np.argmax(sim_diffs))
     
-    for i in range(len(all_pairs)):
-        for j in range(i + 1, len(all_pairs)):
-            pair1 = all_pairs[i]
-            pair2 = all_pairs[j]
-            
-            if (pair1['pred_idx'] == pair2['pred_idx'] or 
-                pair1['truth_idx'] == pair2['truth_idx']):
-                continue
-            
-            sim_diff = abs(pair1['similarity'] - pair2['similarity'])
-            if sim_diff > best_variance:
-                best_variance = sim_diff
-                best_pair_combo = (pair1, pair2)
+    best_pair_combo = None
+    if sim_diffs.flat[best] >= 0:
+        i, j = divmod(best, n)
+        best_pair_combo = (all_pairs[i], all_pairs[j])
     
-    # 输出结果
+    # 输出结果 (归一化后的相似度已保留4位小数)
     if best_pair_combo:
         pair1, pair2 = best_pair_combo
         return [
@@ -389,14 +679,14 @@ def generate_task3_pairs(
                 'pair_id': 'A',
                 'predicted': pair1['predicted'],
                 'ground_truth': pair1['ground_truth'],
-                'similarity': round(pair1['similarity'], 4),
+                'similarity': pair1['similarity'],
                 'similarity_original': pair1['similarity_original']
             },
             {
                 'pair_id': 'B',
                 'predicted': pair2['predicted'],
                 'ground_truth': pair2['ground_truth'],
-                'similarity': round(pair2['similarity'], 4),
+                'similarity': pair2['similarity'],
                 'similarity_original': pair2['similarity_original']
             }
         ]
@@ -423,9 +713,10 @@ def generate_task3_pairs(
 def create_default_pairs(
     pred_diff_list: List[str],
     truth_diff_list: List[str],
-    similarity_matrix: Optional[List[List[float]]] = None
+    similarity_matrix: Optional[np.ndarray] = None
 ) -> List[Dict]:
     """创建默认的两对诊断"""
+    similarity_matrix = to_similarity_array(similarity_matrix)
     pairs = []
     
     for i in range(2):
@@ -435,9 +726,8 @@ def create_default_pairs(
         pred = pred_diff_list[pred_idx] if pred_diff_list else "无预测诊断"
         truth = truth_diff_list[truth_idx] if truth_diff_list else "无真实诊断"
         
-        if similarity_matrix and pred_idx < len(similarity_matrix) and truth_idx < len(similarity_matrix[pred_idx]):
-            similarity = similarity_matrix[pred_idx][truth_idx]
-        else:
+        similarity = get_dermlip_similarity(similarity_matrix, pred_idx, truth_idx)
+        if similarity is None:
             similarity = calculate_jaccard_similarity(pred, truth)
         
         pairs.append({
@@ -476,8 +766,7 @@ def load_mismatch_case_ids_from_folder(folder_path: str, target_file: Optional[s
     for fn in files_to_scan:
         path = os.path.join(folder_path, fn)
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_json(path)
         except Exception:
             continue
 
@@ -508,33 +797,144 @@ def load_mismatch_case_ids_from_folder(folder_path: str, target_file: Optional[s
     return mismatch_ids
 
 
+def process_sample(
+    idx: int,
+    sample: Dict,
+    medical_data: List[Dict],
+    use_dermlip: bool = True,
+    debug: bool = False,
+    medical_gt: Optional[Dict] = None
+) -> Tuple[Dict, bool, int]:
+    """
+    处理单个评估样本
+    debug=True 时额外保存完整的鉴别诊断列表
+    medical_gt 为 prepare_medical_gt(medical_data) 的结果
+    
+    Returns:
+        (病例数据, 是否通过GT匹配成功, 替换前缀的路径数)
+    """
+    case_id = sample.get('id', f'case_{idx}')
+    
+    # 提取预测和真实的鉴别诊断
+    pred_diff = as_diagnosis_list(sample.get('predicted_differential', []))
+    truth_diff = as_diagnosis_list(sample.get('ground_truth_differential', []))
+    
+    # 获取相似度矩阵
+    similarity_matrix = None
+    if use_dermlip:
+        dermlip_metrics = sample.get('dermlip_metrics', {})
+        # 每个样本只转换一次为 NumPy 数组
+        similarity_matrix = to_similarity_array(dermlip_metrics.get('similarity_matrix', None))
+    
+    # 匹配medical_data以获取image_paths和prompt
+    matched_item = match_case_by_gt(sample, medical_data, medical_gt=medical_gt)
+    
+    if matched_item:
+        image_paths = matched_item.get('image_paths', [])
+        prompt = matched_item.get('prompt', '')
+    elif idx < len(medical_data):
+        # 尝试按顺序匹配(作为后备方案)
+        image_paths = medical_data[idx].get('image_paths', [])
+        prompt = medical_data[idx].get('prompt', '')
+    else:
+        image_paths = []
+        prompt = ''
+    
+    # 替换路径前缀
+    image_paths, replaced_count = replace_path_prefix(image_paths)
+    
+    # 生成task3_pairs：选择相似度波动大的两对，且确保 predicted != ground_truth
+    task3_pairs = generate_task3_pairs(
+        pred_diff, 
+        truth_diff, 
+        similarity_matrix
+    )
+    
+    # 构建病例数据
+    case_data = {
+        "id": case_id,
+        "pmid": case_id,
+        
+        # 任务1：图片路径和提示词
+        "image_paths": image_paths,
+        "prompt": prompt,
+        
+        # 任务2：诊断
+        "predicted_diagnosis": sample.get('predicted_differential_text', ''),
+        "ground_truth_diagnosis": ' | '.join(truth_diff),
+        
+        # 任务3：两对诊断及相似度
+        "task3_pairs": task3_pairs
+    }
+    
+    # 额外信息(仅调试时保存，避免输出体积翻倍)
+    if debug:
+        case_data["predicted_differential_diagnosis_full"] = pred_diff
+        case_data["ground_truth_differential_diagnosis_full"] = truth_diff
+    
+    # 相似度波动指标
+    case_data["similarity_variance"], case_data["similarity_range"] = calculate_similarity_stats(task3_pairs)
+    
+    return case_data, matched_item is not None, replaced_count
+
+
+# 工作进程内共享的只读数据 (由 _init_sample_worker 设置)
+_worker_medical_data: List[Dict] = []
+_worker_medical_gt: Optional[Dict] = None
+_worker_use_dermlip = True
+_worker_debug = False
+
+
+def _init_sample_worker(medical_data: List[Dict], use_dermlip: bool, debug: bool) -> None:
+    """进程池初始化：每个工作进程只接收一次 medical_data，并各自预处理GT"""
+    global _worker_medical_data, _worker_medical_gt, _worker_use_dermlip, _worker_debug
+    _worker_medical_data = medical_data
+    _worker_medical_gt = prepare_medical_gt(medical_data)
+    _worker_use_dermlip = use_dermlip
+    _worker_debug = debug
+
+
+def _process_sample_in_worker(item: Tuple[int, Dict]) -> Tuple[Dict, bool, int]:
+    """在工作进程中处理单个样本"""
+    idx, sample = item
+    return process_sample(idx, sample, _worker_medical_data, _worker_use_dermlip, _worker_debug,
+                          _worker_medical_gt)
+
+
 def process_evaluation_data(
     eval_file: str,
     medical_file: str,
-    output_file: str,
+    output_file: Optional[str] = None,
     use_dermlip: bool = True,
-    case_id_filter: Optional[set] = None
+    case_id_filter: Optional[set] = None,
+    workers: int = 1,
+    debug: bool = False
 ) -> List[Dict]:
-    """处理评估数据，匹配图片路径，生成标准格式"""
+    """
+    处理评估数据，匹配图片路径，生成标准格式
+    workers > 1 时使用多进程并行处理各病例，输出顺序不变
+    (每个工作进程都要重建GT索引，病例较少时通常比串行更慢，需显式开启)
+    debug=True 时在输出中保留完整的鉴别诊断列表(*_differential_diagnosis_full)
+    output_file 为 None 时不写出临时文件，只返回处理结果
+    """
     print(f"读取评估数据: {eval_file}")
-    with open(eval_file, 'r', encoding='utf-8') as f:
-        eval_data = json.load(f)
 
-    # 获取并过滤 per_sample_results
-    per_sample_results = eval_data.get('per_sample_results', [])
-    if case_id_filter is not None:
-        original_len = len(per_sample_results)
-        filtered = []
-        for sample in per_sample_results:
+    # 流式读取并过滤 per_sample_results，通过过滤的样本只保留所需字段
+    per_sample_results = []
+    original_len = 0
+    for sample in iter_per_sample_results(eval_file):
+        original_len += 1
+        if case_id_filter is not None:
             cid = sample.get('case_id') or sample.get('id') or sample.get('pmid')
-            if cid and cid in case_id_filter:
-                filtered.append(sample)
-        per_sample_results = filtered
+            if not cid or cid not in case_id_filter:
+                continue
+        per_sample_results.append(project_eval_sample(sample))
+    if case_id_filter is not None:
         print(f"  应用 case_id_filter: 从 {original_len} 条样本中筛选出 {len(per_sample_results)} 条用于后续处理")
 
     print(f"读取医疗数据: {medical_file}")
-    with open(medical_file, 'r', encoding='utf-8') as f:
-        medical_data = json.load(f)
+    # medical_data 只读，重复调用时复用已解析的结果
+    medical_data = load_json_cached(medical_file)
     
     print(f"评估数据: {len(per_sample_results)} 个病例")  # 改为显示过滤后的数量
     print(f"医疗数据: {len(medical_data)} 个病例")
@@ -550,98 +950,57 @@ def process_evaluation_data(
     print(f"开始处理病例(共 {len(per_sample_results)} 个)...")  # 这里会显示正确的数量
     print(f"{'='*70}")
     
-    start_time = datetime.now()
+    start_time = time.perf_counter()
     
-    for idx, sample in enumerate(per_sample_results):
-        # 每处理500个病例显示一次进度
-        if (idx + 1) % 500 == 0 or idx == 0:
-            elapsed = (datetime.now() - start_time).total_seconds()
-            speed = (idx + 1) / elapsed if elapsed > 0 else 0
-            eta = (len(per_sample_results) - idx - 1) / speed if speed > 0 else 0
-            
-            print(f"\n进度: {idx + 1}/{len(per_sample_results)} ({(idx+1)/len(per_sample_results)*100:.1f}%)")
-            print(f"  ├─ GT匹配成功: {matched_count}")
-            print(f"  ├─ 顺序匹配: {fallback_count}")
-            print(f"  ├─ 无图片: {no_image_count}")
-            print(f"  ├─ 路径已替换: {total_path_replaced}")
-            print(f"  ├─ 处理速度: {speed:.1f} 个/秒")
-            print(f"  └─ 预计剩余时间: {eta/60:.1f} 分钟")
-        
-        case_id = sample.get('id', f'case_{idx}')
-        
-        # 提取预测和真实的鉴别诊断
-        pred_diff = sample.get('predicted_differential', [])
-        truth_diff = sample.get('ground_truth_differential', [])
-        
-        if not isinstance(pred_diff, list):
-            pred_diff = []
-        if not isinstance(truth_diff, list):
-            truth_diff = []
-        
-        # 获取相似度矩阵
-        similarity_matrix = None
-        if use_dermlip:
-            dermlip_metrics = sample.get('dermlip_metrics', {})
-            similarity_matrix = dermlip_metrics.get('similarity_matrix', None)
-        
-        # 匹配medical_data以获取image_paths和prompt
-        matched_item = match_case_by_gt(sample, medical_data)
-        
-        if matched_item:
-            matched_count += 1
-            image_paths = matched_item.get('image_paths', [])
-            prompt = matched_item.get('prompt', '')
-        else:
-            # 尝试按顺序匹配(作为后备方案)
-            fallback_count += 1
-            if idx < len(medical_data):
-                image_paths = medical_data[idx].get('image_paths', [])
-                prompt = medical_data[idx].get('prompt', '')
-            else:
-                image_paths = []
-                prompt = ''
-        
-        # 统计无图片的病例
-        if not image_paths or len(image_paths) == 0:
-            no_image_count += 1
-        
-        # 替换路径前缀
-        image_paths, replaced_count = replace_path_prefix(image_paths)
-        total_path_replaced += replaced_count
-        
-        # 生成task3_pairs：选择相似度波动大的两对，且确保 predicted != ground_truth
-        task3_pairs = generate_task3_pairs(
-            pred_diff, 
-            truth_diff, 
-            similarity_matrix
+    if workers > 1:
+        # 多进程处理：medical_data 只在每个工作进程初始化时传递一次
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_sample_worker,
+            initargs=(medical_data, use_dermlip, debug)
         )
-        
-        # 构建病例数据
-        case_data = {
-            "id": case_id,
-            "pmid": case_id,
-            
-            # 任务1：图片路径和提示词
-            "image_paths": image_paths,
-            "prompt": prompt,
-            
-            # 任务2：诊断
-            "predicted_diagnosis": sample.get('predicted_differential_text', ''),
-            "ground_truth_diagnosis": ' | '.join(truth_diff) if truth_diff else '',
+        chunksize = max(1, len(per_sample_results) // (workers * 8))
+        results = executor.map(_process_sample_in_worker, enumerate(per_sample_results), chunksize=chunksize)
+    else:
+        executor = None
+        medical_gt = prepare_medical_gt(medical_data)
+        results = (process_sample(idx, sample, medical_data, use_dermlip, debug, medical_gt)
+                   for idx, sample in enumerate(per_sample_results))
+    
+    try:
+        for idx, (case_data, matched, replaced_count) in enumerate(results):
+            # 每处理500个病例显示一次进度
+            if (idx + 1) % 500 == 0 or idx == 0:
+                elapsed = time.perf_counter() - start_time
+                speed = (idx + 1) / elapsed if elapsed > 0 else 0
+                eta = (len(per_sample_results) - idx - 1) / speed if speed > 0 else 0
+                
+                # 整个进度块拼成一次输出
+                print(
+                    f"\n进度: {idx + 1}/{len(per_sample_results)} ({(idx+1)/len(per_sample_results)*100:.1f}%)\n"
+                    f"  ├─ GT匹配成功: {matched_count}\n"
+                    f"  ├─ 顺序匹配: {fallback_count}\n"
+                    f"  ├─ 无图片: {no_image_count}\n"
+                    f"  ├─ 路径已替换: {total_path_replaced}\n"
+                    f"  ├─ 处理速度: {speed:.1f} 个/秒\n"
+                    f"  └─ 预计剩余时间: {eta/60:.1f} 分钟",
+                    flush=True
+                )
             
-            # 任务3：两对诊断及相似度
-            "task3_pairs": task3_pairs,
+            if matched:
+                matched_count += 1
+            else:
+                fallback_count += 1
             
-            # 额外信息
-            "predicted_differential_diagnosis_full": pred_diff,
-            "ground_truth_differential_diagnosis_full": truth_diff,
+            # 统计无图片的病例
+            if not case_data['image_paths']:
+                no_image_count += 1
+            total_path_replaced += replaced_count
             
-            # 相似度波动指标
-            "similarity_variance": calculate_similarity_variance(task3_pairs),
-            "similarity_range": calculate_similarity_range(task3_pairs)
-        }
-        
-        processed_cases.append(case_data)
+            processed_cases.append(case_data)
+    finally:
+        if executor is not None:
+            executor.shutdown()
     
     # 最终统计
     print(f"\n{'='*70}")
@@ -654,10 +1013,9 @@ def process_evaluation_data(
     print(f"路径已替换: {total_path_replaced}")
     
     # 保存处理后的数据
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(processed_cases, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n临时数据已保存到: {output_file}")
+    if output_file:
+        dump_json_array(processed_cases, output_file)
+        print(f"\n临时数据已保存到: {output_file}")
     
     return processed_cases
 
@@ -668,41 +1026,123 @@ def get_image_signature(image_paths: List[str]) -> str:
     """
     if not image_paths:
         return ""
-    # 提取文件名并排序，确保相同图片集合生成相同签名
-    sorted_paths = sorted([os.path.basename(p) for p in image_paths])
-    return "|".join(sorted_paths)
+    # 提取文件名并排序，确保相同图片集合生成相同签名 (os.path.basename 在 Windows 上也处理 '\' 分隔)
+    return "|".join(sorted(os.path.basename(p) for p in image_paths))
+
+
+# 筛选规则用到的必需字段
+REQUIRED_CASE_FIELDS = ('id', 'pmid', 'prompt')
+TASK3_PAIR_FIELDS = ('pair_id', 'predicted', 'ground_truth', 'similarity')
+# 字段缺失的占位值 (区别于值为 None)
+_MISSING = object()
+
+
+def _collect_remove_reasons(
+    case: Dict,
+    pred_diag: str,
+    truth_diag: str,
+    task3_pairs: List[Dict],
+    image_paths: List[str],
+    img_signature: str,
+    used_image_signatures: set,
+    min_similarity_variance: float,
+    fast_mode: bool = False
+) -> List[Tuple[str, str]]:
+    """
+    依次检查单个病例的各条筛选规则
+    
+    Returns:
+        [(统计类别, 移除原因), ...]；fast_mode 时最多返回一条
+    """
+    reasons = []
+    
+    # 规则1: 检查是否有None值
+    if has_none_values(case):
+        reasons.append(('包含None值', "包含None值"))
+        if fast_mode:
+            return reasons
+    
+    # 规则2: 检查task3_pairs
+    task3_valid, task3_reason = validate_task3_pairs(task3_pairs)
+    if not task3_valid:
+        reasons.append(('task3_pairs问题', task3_reason))
+        if fast_mode:
+            return reasons
+    
+    # 规则3: 检查 task3_pairs 中是否有 predicted 和 ground_truth 相同的情况
+    if task3_pairs:
+        for pair in task3_pairs:
+            if are_diagnoses_same(pair.get('predicted', ''), pair.get('ground_truth', ''), similarity_threshold=0.85):
+                reasons.append(('pair中predicted和truth相同', f"Pair {pair.get('pair_id')}中predicted和truth实质相同"))
+                if fast_mode:
+                    return reasons
+                break
+    
+    # 规则4: 检查诊断是否一致
+    if not pred_diag or not truth_diag:
+        reasons.append(('诊断为空', "诊断为空"))
+    elif diagnoses_are_same(pred_diag, truth_diag):
+        reasons.append(('诊断一致', "诊断完全一致"))
+    if fast_mode and reasons:
+        return reasons
+    
+    # 规则5: 检查图片路径
+    if not image_paths:
+        reasons.append(('无图片路径', "无图片路径"))
+        if fast_mode:
+            return reasons
+    
+    # 规则6: 检查必需字段
+    for field in REQUIRED_CASE_FIELDS:
+        if not case.get(field):
+            reasons.append(('缺少必需字段', f"缺少必需字段: {field}"))
+            if fast_mode:
+                return reasons
+            break
+    
+    # 规则7: 检查相似度波动
+    sim_variance = case.get('similarity_variance', 0.0)
+    if sim_variance < min_similarity_variance:
+        reasons.append(('相似度波动过小', f"相似度波动过小: {sim_variance:.4f} < {min_similarity_variance}"))
+        if fast_mode:
+            return reasons
+    
+    # 规则8: 检查图片是否重复
+    if image_paths and img_signature in used_image_signatures:
+        reasons.append(('图片重复', "图片集合重复"))
+    
+    return reasons
 
 
 def validate_and_filter_data(
-    input_file: str,
+    input_file: Union[str, List[Dict]],
     output_file: str,
     max_cases: int = 50,
     min_similarity_variance: float = 0.0,
     random_selection: bool = True,
-    random_seed: int = 42
+    random_seed: int = 42,
+    fast_mode: bool = False
 ) -> Tuple[List[Dict], List[Dict]]:
     """
     验证并筛选数据，优先保留相似度波动大的病例
     
     Args:
-        input_file: 输入文件路径
+        input_file: 输入文件路径，或 process_evaluation_data 返回的病例列表（跳过读文件）
         output_file: 输出文件路径
         max_cases: 最大保留病例数
         min_similarity_variance: 最小相似度波动阈值
         random_selection: 是否随机选择（而非连续选择）
         random_seed: 随机种子
+        fast_mode: 遇到第一条不满足的规则即停止检查（移除原因只记录一条）
     """
     print(f"\n{'='*70}")
     print("步骤2: 开始数据筛选和验证")
     print(f"{'='*70}")
     
-    # 设置随机种子以确保可重复性
-    if random_selection:
-        random.seed(random_seed)
-        np.random.seed(random_seed)
+    # 使用独立的随机数生成器确保可重复性，不修改全局随机状态
+    rng = random.Random(random_seed) if random_selection else None
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(input_file) if isinstance(input_file, str) else input_file
     
     print(f"读取临时数据: {len(data)} 个病例")
     print(f"随机选择模式: {'开启' if random_selection else '关闭'}")
@@ -733,68 +1173,23 @@ def validate_and_filter_data(
         if (idx + 1) % 1000 == 0:
             print(f"  验证进度: {idx + 1}/{len(data)} ({(idx+1)/len(data)*100:.1f}%)")
         
-        case_id = case.get('pmid', case.get('id', f'case_{idx}'))
-        remove_reasons = []
-        
-        # 规则1: 检查是否有None值
-        if has_none_values(case):
-            remove_reasons.append("包含None值")
-            reason_stats['包含None值'] += 1
-        
-        # 规则2: 检查task3_pairs
-        task3_valid, task3_reason = validate_task3_pairs(case.get('task3_pairs', []))
-        if not task3_valid:
-            remove_reasons.append(task3_reason)
-            reason_stats['task3_pairs问题'] += 1
-        
-        # 规则3: 检查 task3_pairs 中是否有 predicted 和 ground_truth 相同的情况
-        task3_pairs = case.get('task3_pairs', [])
-        if task3_pairs:
-            for pair in task3_pairs:
-                pred = pair.get('predicted', '')
-                truth = pair.get('ground_truth', '')
-                if are_diagnoses_same(pred, truth, similarity_threshold=0.85):
-                    remove_reasons.append(f"Pair {pair.get('pair_id')}中predicted和truth实质相同")
-                    reason_stats['pair中predicted和truth相同'] += 1
-                    break
-        
-        # 规则4: 检查诊断是否一致
-        pred_diag = case.get('predicted_diagnosis', '')
-        truth_diag = case.get('ground_truth_diagnosis', '')
-        
-        if not pred_diag or not truth_diag:
-            remove_reasons.append("诊断为空")
-            reason_stats['诊断为空'] += 1
-        elif diagnoses_are_same(pred_diag, truth_diag):
-            remove_reasons.append(f"诊断完全一致")
-            reason_stats['诊断一致'] += 1
+        get = case.get
+        case_id = get('pmid', get('id', f'case_{idx}'))
+        pred_diag = get('predicted_diagnosis', '')
+        truth_diag = get('ground_truth_diagnosis', '')
+        task3_pairs = get('task3_pairs', [])
+        image_paths = get('image_paths', [])
+        # 图片签名每个病例只计算一次
+        img_signature = get_image_signature(image_paths)
         
-        # 规则5: 检查图片路径
-        image_paths = case.get('image_paths', [])
-        if not image_paths or len(image_paths) == 0:
-            remove_reasons.append("无图片路径")
-            reason_stats['无图片路径'] += 1
-        
-        # 规则6: 检查必需字段
-        required_fields = ['id', 'pmid', 'prompt']
-        for field in required_fields:
-            if not case.get(field):
-                remove_reasons.append(f"缺少必需字段: {field}")
-                reason_stats['缺少必需字段'] += 1
-                break
-        
-        # 规则7: 检查相似度波动
-        sim_variance = case.get('similarity_variance', 0.0)
-        if sim_variance < min_similarity_variance:
-            remove_reasons.append(f"相似度波动过小: {sim_variance:.4f} < {min_similarity_variance}")
-            reason_stats['相似度波动过小'] += 1
-        
-        # 规则8: 检查图片是否重复
-        if image_paths:
-            img_signature = get_image_signature(image_paths)
-            if img_signature in used_image_signatures:
-                remove_reasons.append(f"图片集合重复")
-                reason_stats['图片重复'] += 1
+        reasons = _collect_remove_reasons(
+            case, pred_diag, truth_diag, task3_pairs, image_paths, img_signature,
+            used_image_signatures, min_similarity_variance, fast_mode
+        )
+        remove_reasons = []
+        for stat_key, message in reasons:
+            reason_stats[stat_key] += 1
+            remove_reasons.append(message)
         
         if remove_reasons:
             removed_cases.append({
@@ -802,14 +1197,13 @@ def validate_and_filter_data(
                 'reasons': remove_reasons,
                 'predicted_diagnosis': pred_diag,
                 'ground_truth_diagnosis': truth_diag,
-                'similarity_variance': case.get('similarity_variance', 0.0),
+                'similarity_variance': get('similarity_variance', 0.0),
                 'task3_pairs': task3_pairs,
-                'image_signature': get_image_signature(image_paths) if image_paths else ''
+                'image_signature': img_signature
             })
         else:
             # 记录图片签名，避免重复
             if image_paths:
-                img_signature = get_image_signature(image_paths)
                 used_image_signatures.add(img_signature)
             valid_cases.append(case)
     
@@ -829,20 +1223,21 @@ def validate_and_filter_data(
         print(f"{'='*70}")
         
         # 按相似度波动(标准差和极差的组合)降序排序
-        valid_cases.sort(
-            key=lambda x: (
-                x.get('similarity_variance', 0) * 0.6 + 
-                x.get('similarity_range', 0) * 0.4
-            ),
-            reverse=True
-        )
+        # 先向量化计算得分再 argsort；stable 保证得分相同的病例保持原有顺序
+        n_valid = len(valid_cases)
+        variance_arr = np.fromiter((c.get('similarity_variance', 0) for c in valid_cases), dtype=np.float64, count=n_valid)
+        range_arr = np.fromiter((c.get('similarity_range', 0) for c in valid_cases), dtype=np.float64, count=n_valid)
+        order = np.argsort(-(variance_arr * 0.6 + range_arr * 0.4), kind='stable')
+        valid_cases = [valid_cases[i] for i in order.tolist()]
+        # 排序后的方差数组，供后续分档复用
+        variance_arr = variance_arr[order]
         
         # 显示波动分布
         print(f"\n相似度波动分析:")
-        top_10 = [round(c.get('similarity_variance', 0), 4) for c in valid_cases[:10]]
+        top_10 = [round(v, 4) for v in variance_arr[:10].tolist()]
         print(f"  前10个病例的方差: {top_10}")
         if len(valid_cases) >= 10:
-            bottom_10 = [round(c.get('similarity_variance', 0), 4) for c in valid_cases[-10:]]
+            bottom_10 = [round(v, 4) for v in variance_arr[-10:].tolist()]
             print(f"  后10个病例的方差: {bottom_10}")
         
         if random_selection:
@@ -850,16 +1245,21 @@ def validate_and_filter_data(
             print(f"\n使用随机选择模式 (种子={random_seed}):")
             
             # 将病例分成高、中、低波动三档
-            variances = [c.get('similarity_variance', 0) for c in valid_cases]
-            high_threshold = np.percentile(variances, 75)
-            medium_threshold = np.percentile(variances, 50)
+            variances = variance_arr.tolist()
+            high_threshold = np.percentile(variance_arr, 75)
+            medium_threshold = np.percentile(variance_arr, 50)
             
-            high_variance_cases = [c for c in valid_cases 
-                                  if c.get('similarity_variance', 0) >= high_threshold]
-            medium_variance_cases = [c for c in valid_cases 
-                                    if medium_threshold <= c.get('similarity_variance', 0) < high_threshold]
-            low_variance_cases = [c for c in valid_cases 
-                                 if c.get('similarity_variance', 0) < medium_threshold]
+            # 单次遍历完成分档
+            high_variance_cases = []
+            medium_variance_cases = []
+            low_variance_cases = []
+            for c, variance in zip(valid_cases, variances):
+                if variance >= high_threshold:
+                    high_variance_cases.append(c)
+                elif variance >= medium_threshold:
+                    medium_variance_cases.append(c)
+                else:
+                    low_variance_cases.append(c)
             
             print(f"  高波动病例: {len(high_variance_cases)} 个 (>= {high_threshold:.4f})")
             print(f"  中波动病例: {len(medium_variance_cases)} 个 (>= {medium_threshold:.4f})")
@@ -894,14 +1294,14 @@ def validate_and_filter_data(
             # 随机采样
             selected_cases = []
             if n_high > 0 and len(high_variance_cases) > 0:
-                selected_cases.extend(random.sample(high_variance_cases, n_high))
+                selected_cases.extend(rng.sample(high_variance_cases, n_high))
             if n_medium > 0 and len(medium_variance_cases) > 0:
-                selected_cases.extend(random.sample(medium_variance_cases, n_medium))
+                selected_cases.extend(rng.sample(medium_variance_cases, n_medium))
             if n_low > 0 and len(low_variance_cases) > 0:
-                selected_cases.extend(random.sample(low_variance_cases, n_low))
+                selected_cases.extend(rng.sample(low_variance_cases, n_low))
             
             # 随机打乱顺序，确保不相邻
-            random.shuffle(selected_cases)
+            rng.shuffle(selected_cases)
             
             print(f"\n实际选择: {len(selected_cases)} 个病例")
             
@@ -930,8 +1330,7 @@ def validate_and_filter_data(
             })
     
     # 保存有效数据
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(valid_cases, f, ensure_ascii=False, indent=2)
+    dump_json(valid_cases, output_file)
     
     # 输出最终统计信息
     print(f"\n{'='*70}")
@@ -944,20 +1343,21 @@ def validate_and_filter_data(
     
     # 统计最终保留病例的相似度波动
     if valid_cases:
-        variances = [c.get('similarity_variance', 0) for c in valid_cases]
-        ranges = [c.get('similarity_range', 0) for c in valid_cases]
+        n_valid = len(valid_cases)
+        variances = np.fromiter((c.get('similarity_variance', 0) for c in valid_cases), dtype=np.float64, count=n_valid)
+        ranges = np.fromiter((c.get('similarity_range', 0) for c in valid_cases), dtype=np.float64, count=n_valid)
         
         print(f"\n保留病例的相似度波动统计:")
         print(f"  方差统计:")
-        print(f"    平均值: {np.mean(variances):.4f}")
+        print(f"    平均值: {variances.mean():.4f}")
         print(f"    中位数: {np.median(variances):.4f}")
-        print(f"    最大值: {np.max(variances):.4f}")
-        print(f"    最小值: {np.min(variances):.4f}")
+        print(f"    最大值: {variances.max():.4f}")
+        print(f"    最小值: {variances.min():.4f}")
         print(f"  极差统计:")
-        print(f"    平均值: {np.mean(ranges):.4f}")
+        print(f"    平均值: {ranges.mean():.4f}")
         print(f"    中位数: {np.median(ranges):.4f}")
-        print(f"    最大值: {np.max(ranges):.4f}")
-        print(f"    最小值: {np.min(ranges):.4f}")
+        print(f"    最大值: {ranges.max():.4f}")
+        print(f"    最小值: {ranges.min():.4f}")
     
     print(f"\n✓ 最终数据已保存到: {output_file}")
     print(f"{'='*70}\n")
@@ -965,19 +1365,20 @@ def validate_and_filter_data(
     return valid_cases, removed_cases
 
 
-def has_none_values(obj, path="") -> bool:
-    """递归检查对象中是否有None值"""
-    if obj is None:
-        return True
-    
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if has_none_values(value, f"{path}.{key}"):
-                return True
-    elif isinstance(obj, list):
-        for i, item in enumerate(obj):
-            if has_none_values(item, f"{path}[{i}]"):
-                return True
+def has_none_values(obj) -> bool:
+    """检查对象中是否有None值（数据来自 JSON，只需处理 dict / list；用显式栈遍历，不受递归深度限制）"""
+    stack = [obj]
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        item = pop()
+        if item is None:
+            return True
+        t = type(item)
+        if t is dict:
+            extend(item.values())
+        elif t is list:
+            extend(item)
     
     return False
 
@@ -991,12 +1392,14 @@ def validate_task3_pairs(pairs: List[Dict]) -> Tuple[bool, str]:
         if not isinstance(pair, dict):
             return False, f"task3_pairs[{i}]不是字典"
         
-        required_fields = ['pair_id', 'predicted', 'ground_truth', 'similarity']
-        for field in required_fields:
-            if field not in pair:
-                return False, f"task3_pairs[{i}]缺少字段: {field}"
-            if pair[field] is None:
-                return False, f"task3_pairs[{i}].{field}为None"
+        # 一次取出所有字段；只有存在缺失或 None 时才逐个定位具体字段
+        values = [pair.get(field, _MISSING) for field in TASK3_PAIR_FIELDS]
+        if _MISSING in values or None in values:
+            for field, value in zip(TASK3_PAIR_FIELDS, values):
+                if value is _MISSING:
+                    return False, f"task3_pairs[{i}]缺少字段: {field}"
+                if value is None:
+                    return False, f"task3_pairs[{i}].{field}为None"
     
     pair_a, pair_b = pairs[0], pairs[1]
     
@@ -1010,10 +1413,14 @@ def validate_task3_pairs(pairs: List[Dict]) -> Tuple[bool, str]:
     return True, ""
 
 
+@lru_cache(maxsize=8192)
 def diagnoses_are_same(diag1: str, diag2: str) -> bool:
-    """判断两个诊断是否相同"""
+    """判断两个诊断是否相同 (结果按诊断对缓存，数据集中重复出现的诊断对只计算一次)"""
     if not diag1 or not diag2:
         return False
+    # 原始字符串相同则标准化后也相同，直接返回
+    if diag1 == diag2:
+        return True
     
     d1 = normalize_diagnosis(diag1)
     d2 = normalize_diagnosis(diag2)
@@ -1021,11 +1428,12 @@ def diagnoses_are_same(diag1: str, diag2: str) -> bool:
     if d1 == d2:
         return True
     
-    # 检查包含关系
-    if d1 in d2 or d2 in d1:
-        len_ratio = min(len(d1), len(d2)) / max(len(d1), len(d2))
-        if len_ratio > 0.8:
-            return True
+    # 检查包含关系：长度比 > 0.8 用整数比较 (5 * 短 > 4 * 长)，满足时才做子串查找
+    l1, l2 = len(d1), len(d2)
+    if l1 > l2:
+        l1, l2 = l2, l1
+    if 5 * l1 > 4 * l2 and (d1 in d2 or d2 in d1):
+        return True
     
     return False
 
@@ -1043,6 +1451,9 @@ def main():
     medical_file = "SCIN_DD_input.json"
     temp_output = "data_temp.json"
     final_output = "data_filtered.json"
+    # 调试模式：写出中间文件 temp_output，并保留完整的鉴别诊断列表
+    # 非调试时步骤1的结果直接在内存中传给步骤2，省去一次完整的写出和读回
+    debug = False
     
     # 步骤0: 从指定的 scin_final_diagnosis_evaluation.json 中获取诊断不一致的case_ids（避免读取脚本输出文件）
     print("\n📋 步骤0: 获取诊断不一致的病例ID")
@@ -1062,9 +1473,11 @@ def main():
         processed_data = process_evaluation_data(
             eval_file=eval_file,
             medical_file=medical_file,
-            output_file=temp_output,
+            output_file=temp_output if debug else None,
             use_dermlip=True,
-            case_id_filter=mismatch_case_ids  # 添加这个参数
+            case_id_filter=mismatch_case_ids,  # 添加这个参数
+            workers=1,  # 多进程需每个进程重建GT索引(Windows 上还要传递 medical_data)，默认串行更快
+            debug=debug
         )
     except Exception as e:
         print(f"\n❌ 错误: 步骤1处理失败")
@@ -1076,7 +1489,7 @@ def main():
     print("-" * 70)
     try:
         valid_cases, removed_cases = validate_and_filter_data(
-            input_file=temp_output,
+            input_file=processed_data,
             output_file=final_output,
             max_cases=50,
             min_similarity_variance=0.0,
@@ -1133,7 +1546,8 @@ def main():
     print("="*70)
     print("\n✓ 所有处理完成！")
     print(f"✓ 最终数据保存在: {final_output}")
-    print(f"✓ 临时数据保存在: {temp_output}")
+    if debug:
+        print(f"✓ 临时数据保存在: {temp_output}")
     print("="*70 + "\n")
 
 
@@ -1,31 +1,74 @@
-import json
 import random
 from pathlib import Path
 
-def add_case_ids(input_file, output_file):
-    """给输入文件添加case_id"""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+from json_io import HAS_IJSON, load_json, dump_json, iter_json_items
+
+def add_case_ids(input_file, output_file=None, pretty=True):
+    """
+    给输入文件添加case_id
+    
+    Args:
+        output_file: 输出文件路径；为None时不写文件，只返回内存中的数据供后续步骤直接使用
+        pretty: 是否缩进输出；输出只作为中间文件时可设为False，序列化更快、文件更小
+    """
+    data = load_json(input_file)
     
     for idx, item in enumerate(data):
         item['case_id'] = f"case_{idx}"
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    if output_file is not None:
+        dump_json(data, output_file, pretty=pretty)
     
     return data
 
-def load_evaluation_data(eval_file):
-    """加载评估数据文件"""
-    with open(eval_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return data
+# merge_and_filter 只用到评估结果中的这几个字段
+EVAL_FIELDS = ('case_id', 'predicted_diagnosis', 'ground_truth_diagnosis')
+
+def load_evaluation_data(eval_file, fields=None):
+    """
+    加载评估数据文件
+    
+    指定 fields 时只读取 per_sample_results (安装了 ijson 时流式读取)，
+    每条结果只保留 fields 中的字段，不保留指标等其余内容
+    """
+    if fields is None:
+        return load_json(eval_file)
+    results = [{key: item[key] for key in fields if key in item}
+               for item in iter_json_items(eval_file, 'per_sample_results.item')]
+    return {'per_sample_results': results}
 
 def load_template_data(template_file):
     """加载模板数据文件"""
-    with open(template_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return data
+    return load_json(template_file)
+
+def sample_template_data(template_file, n_samples):
+    """
+    从模板文件中随机抽取n个样本，返回 (选中的样本, 模板总数)
+
+    安装了 ijson 时分两遍流式读取：第一遍只计数，第二遍只保留被抽中的元素，
+    内存占用与 n_samples 成正比而不是整个模板文件。
+    抽样对 range(总数) 调用 random.sample，与对整个列表调用 random.sample
+    消耗相同的随机数，结果完全一致。
+    """
+    if not HAS_IJSON:
+        template_data = load_json(template_file)
+        if len(template_data) < n_samples:
+            return template_data, len(template_data)
+        return random.sample(template_data, n_samples), len(template_data)
+
+    total = sum(1 for _ in iter_json_items(template_file))
+    if total < n_samples:
+        indices = list(range(total))
+    else:
+        indices = random.sample(range(total), n_samples)
+
+    wanted = {idx: pos for pos, idx in enumerate(indices)}
+    selected = [None] * len(indices)
+    for idx, item in enumerate(iter_json_items(template_file)):
+        pos = wanted.get(idx)
+        if pos is not None:
+            selected[pos] = item
+    return selected, total
 
 def merge_and_filter(cases_with_ids, eval_data, template_data, n_samples=50, output_file='output_filtered.json'):
     """
@@ -34,7 +77,8 @@ def merge_and_filter(cases_with_ids, eval_data, template_data, n_samples=50, out
     Args:
         cases_with_ids: 带有case_id的案例数据
         eval_data: 评估数据
-        template_data: 模板数据（保留task3_pairs及之后的所有内容）
+        template_data: 模板数据（保留task3_pairs及之后的所有内容），
+                       传入文件路径时流式抽样，不载入整个模板
         n_samples: 要选择的样本数量
         output_file: 输出文件路径
     """
@@ -42,17 +86,19 @@ def merge_and_filter(cases_with_ids, eval_data, template_data, n_samples=50, out
     cases_dict = {case['case_id']: case for case in cases_with_ids}
     
     # 创建评估数据的字典，方便查找
-    eval_dict = {}
-    if 'per_sample_results' in eval_data:
-        for item in eval_data['per_sample_results']:
-            eval_dict[item['case_id']] = item
+    eval_dict = {item['case_id']: item for item in eval_data.get('per_sample_results', ())}
     
     # 随机选择n个模板案例
-    if len(template_data) < n_samples:
-        print(f"警告: 模板案例数({len(template_data)})少于请求数({n_samples})")
-        selected_templates = template_data
+    if isinstance(template_data, str):
+        selected_templates, template_count = sample_template_data(template_data, n_samples)
     else:
-        selected_templates = random.sample(template_data, n_samples)
+        template_count = len(template_data)
+        if template_count < n_samples:
+            selected_templates = template_data
+        else:
+            selected_templates = random.sample(template_data, n_samples)
+    if template_count < n_samples:
+        print(f"警告: 模板案例数({template_count})少于请求数({n_samples})")
     
     # 构建输出数据
     output_data = []
@@ -61,34 +107,33 @@ def merge_and_filter(cases_with_ids, eval_data, template_data, n_samples=50, out
         template_case_id = template_item['id']
         
         # 查找对应的案例数据
-        case_data = cases_dict.get(template_case_id, {})
+        case_data = cases_dict.get(template_case_id)
         
         # 查找对应的评估数据
-        eval_item = eval_dict.get(template_case_id, {})
-        
-        # 创建新条目，从模板复制所有内容
-        new_item = template_item.copy()
+        eval_item = eval_dict.get(template_case_id)
         
         # 仅替换指定的字段
+        overrides = {}
         if case_data:
-            new_item['image_paths'] = case_data.get('image_paths', template_item.get('image_paths', []))
-            new_item['prompt'] = case_data.get('prompt', template_item.get('prompt', ''))
+            overrides['image_paths'] = case_data.get('image_paths', template_item.get('image_paths', []))
+            overrides['prompt'] = case_data.get('prompt', template_item.get('prompt', ''))
         
         if eval_item:
-            new_item['predicted_diagnosis'] = eval_item.get('predicted_diagnosis', template_item.get('predicted_diagnosis', ''))
-            new_item['ground_truth_diagnosis'] = eval_item.get('ground_truth_diagnosis', template_item.get('ground_truth_diagnosis', ''))
+            overrides['predicted_diagnosis'] = eval_item.get('predicted_diagnosis', template_item.get('predicted_diagnosis', ''))
+            overrides['ground_truth_diagnosis'] = eval_item.get('ground_truth_diagnosis', template_item.get('ground_truth_diagnosis', ''))
         elif case_data and 'GT' in case_data:
             # 如果评估数据中没有，尝试从案例数据的GT字段获取
-            new_item['ground_truth_diagnosis'] = case_data['GT'].get('label_1', template_item.get('ground_truth_diagnosis', ''))
+            overrides['ground_truth_diagnosis'] = case_data['GT'].get('label_1', template_item.get('ground_truth_diagnosis', ''))
         
+        # 创建新条目：模板的所有内容与替换字段一次合并
         # id和pmid保持不变（使用模板中的值）
-        # task3_pairs及之后的所有内容自动保留（因为使用了copy()）
+        # task3_pairs及之后的所有内容自动保留
+        new_item = {**template_item, **overrides}
         
         output_data.append(new_item)
     
     # 保存输出文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    dump_json(output_data, output_file)
     
     print(f"成功生成 {len(output_data)} 个案例到 {output_file}")
     print(f"选中的案例ID: {[item['id'] for item in output_data[:10]]}...")
@@ -99,6 +144,9 @@ if __name__ == "__main__":
     # 设置随机种子以便结果可复现（可选）
     random.seed(42)
     
+    # 调试模式：保存添加case_id后的中间文件
+    debug = False
+    
     # 文件路径
     INPUT_CASES_FILE = "SCIN_no_DD_input.json"  # 需要添加case_id的原始文件
     CASES_WITH_IDS_FILE = "cases_with_ids.json"  # 添加case_id后的临时文件
@@ -109,25 +157,26 @@ if __name__ == "__main__":
     try:
         # 步骤1: 给原始案例添加case_id
         print("步骤1: 添加case_id...")
-        cases_with_ids = add_case_ids(INPUT_CASES_FILE, CASES_WITH_IDS_FILE)
+        cases_with_ids = add_case_ids(INPUT_CASES_FILE,
+                                      CASES_WITH_IDS_FILE if debug else None,
+                                      pretty=False)
         print(f"已添加case_id，共 {len(cases_with_ids)} 个案例")
         
         # 步骤2: 加载评估数据
         print("\n步骤2: 加载评估数据...")
-        eval_data = load_evaluation_data(EVAL_DATA_FILE)
+        eval_data = load_evaluation_data(EVAL_DATA_FILE, fields=EVAL_FIELDS)
         print("评估数据加载完成")
         
-        # 步骤3: 加载模板数据
+        # 步骤3: 模板数据不整体载入，在步骤4中按文件流式抽样
         print("\n步骤3: 加载模板数据...")
-        template_data = load_template_data(TEMPLATE_FILE)
-        print(f"模板数据加载完成，共 {len(template_data)} 个模板")
+        print(f"模板文件: {TEMPLATE_FILE} (抽样时流式读取)")
         
         # 步骤4: 从模板中随机选择50个案例，仅替换指定字段
         print("\n步骤4: 随机选择50个模板案例并替换指定字段...")
         output_data = merge_and_filter(
             cases_with_ids, 
             eval_data, 
-            template_data, 
+            TEMPLATE_FILE, 
             n_samples=50, 
             output_file=OUTPUT_FILE
         )
@@ -1,37 +1,33 @@
 import json
 
+from json_io import load_json, iter_json_items
+
 # ====== 路径设置 ======
 data_file = "data.json"          
 target_file = "scin_final_diagnosis_evaluation.json"      
 output_file = "data_updated.json"
 
 # ====== 加载文件 ======
-with open(data_file, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-with open(target_file, "r", encoding="utf-8") as f:
-    target = json.load(f)
+data = load_json(data_file)
 
 # ====== 构建 case_id -> diagnosis 映射 ======
-mapping = {}
-for case in target.get("per_sample_results", []):
-    case_id = case.get("case_id")
-    if case_id:
-        mapping[case_id] = {
-            "predicted_diagnosis": case.get("predicted_diagnosis", ""),
-            "ground_truth_diagnosis": case.get("ground_truth_diagnosis", "")
-        }
+# 值为 (predicted_diagnosis, ground_truth_diagnosis) 元组，不为每个病例再建一个字典
+mapping = {
+    case["case_id"]: (case.get("predicted_diagnosis", ""), case.get("ground_truth_diagnosis", ""))
+    for case in iter_json_items(target_file, "per_sample_results.item")
+    if case.get("case_id")
+}
 
 # ====== 替换匹配项 ======
 count_updated = 0
 for item in data:
-    case_id = item.get("id")
-    if case_id in mapping:
-        item["predicted_diagnosis"] = mapping[case_id]["predicted_diagnosis"]
-        item["ground_truth_diagnosis"] = mapping[case_id]["ground_truth_diagnosis"]
+    diagnoses = mapping.get(item.get("id"))
+    if diagnoses is not None:
+        item["predicted_diagnosis"], item["ground_truth_diagnosis"] = diagnoses
         count_updated += 1
 
 # ====== 保存更新后的文件 ======
+# orjson 只支持 2 空格缩进，为保持 indent=4 的输出格式这里仍用标准库写出
 with open(output_file, "w", encoding="utf-8") as f:
     json.dump(data, f, indent=4, ensure_ascii=False)
 
@@ -1,5 +1,14 @@
-import json
 import random
+import re
+from functools import lru_cache
+
+from json_io import load_json, dump_json, dumps_json
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
+# 验证规则用到的字段，在模块级定义一次
+REQUIRED_CASE_FIELDS = ('id', 'pmid', 'prompt')
+TASK3_PAIR_FIELDS = ('pair_id', 'predicted', 'ground_truth', 'similarity')
 
 def validate_and_filter_data(input_file, output_file):
     """
@@ -13,8 +22,7 @@ def validate_and_filter_data(input_file, output_file):
     """
     
     print(f"读取数据: {input_file}")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(input_file)
     
     print(f"原始数据量: {len(data)} 个病例")
     
@@ -49,10 +57,8 @@ def validate_and_filter_data(input_file, output_file):
             remove_reason.append("无图片路径")
         
         # 规则5: 检查必需字段
-        required_fields = ['id', 'pmid', 'prompt']
-        for field in required_fields:
-            if not case.get(field):
-                remove_reason.append(f"缺少必需字段: {field}")
+        remove_reason.extend(f"缺少必需字段: {field}"
+                             for field in REQUIRED_CASE_FIELDS if not case.get(field))
         
         # 判断是否保留
         if remove_reason:
@@ -69,12 +75,11 @@ def validate_and_filter_data(input_file, output_file):
     # 随机保留200个有效病例
     total_valid = len(valid_cases)
     if len(valid_cases) > 200:
-        random.shuffle(valid_cases)
-        valid_cases = valid_cases[:200]
+        # random.sample 只抽取需要的200个，不必打乱整个列表
+        valid_cases = random.sample(valid_cases, 200)
         print(f"\n注意: 有效病例数超过200个({total_valid}个)，随机选择200个保留")
     # 保存有效数据
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(valid_cases, f, ensure_ascii=False, indent=2)
+    dump_json(valid_cases, output_file)
     
     # 输出统计信息
     print("\n" + "="*60)
@@ -110,21 +115,21 @@ def validate_and_filter_data(input_file, output_file):
     return valid_cases, removed_cases
 
 
-def has_none_values(obj, path=""):
+def has_none_values(obj):
     """
-    递归检查对象中是否有 None 值
+    检查对象中是否有 None 值
+    数据来自 JSON，只需处理 dict / list；用显式栈遍历，遇到第一个 None 即返回
     """
-    if obj is None:
-        return True
-    
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if has_none_values(value, f"{path}.{key}"):
-                return True
-    elif isinstance(obj, list):
-        for i, item in enumerate(obj):
-            if has_none_values(item, f"{path}[{i}]"):
-                return True
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            return True
+        t = type(item)
+        if t is dict:
+            stack.extend(item.values())
+        elif t is list:
+            stack.extend(item)
     
     return False
 
@@ -134,28 +139,27 @@ def validate_task3_pairs(pairs):
     验证 task3_pairs
     返回: (是否有效, 错误原因)
     """
-    if not pairs or len(pairs) < 2:
-        return False, f"task3_pairs数量不足2个 (当前: {len(pairs) if pairs else 0})"
+    # 数量不是2时一次判断后直接返回，其余情况不再重复计算长度
+    num_pairs = len(pairs) if pairs else 0
+    if num_pairs != 2:
+        if num_pairs < 2:
+            return False, f"task3_pairs数量不足2个 (当前: {num_pairs})"
+        return False, f"task3_pairs数量超过2个 (当前: {num_pairs})"
     
-    if len(pairs) > 2:
-        return False, f"task3_pairs数量超过2个 (当前: {len(pairs)})"
+    pair_a, pair_b = pairs
     
     # 检查每对的结构
-    for i, pair in enumerate(pairs):
+    for i, pair in enumerate((pair_a, pair_b)):
         if not isinstance(pair, dict):
             return False, f"task3_pairs[{i}]不是字典"
         
-        required_fields = ['pair_id', 'predicted', 'ground_truth', 'similarity']
-        for field in required_fields:
+        for field in TASK3_PAIR_FIELDS:
             if field not in pair:
                 return False, f"task3_pairs[{i}]缺少字段: {field}"
             if pair[field] is None:
                 return False, f"task3_pairs[{i}].{field}为None"
     
     # 检查是否重复
-    pair_a = pairs[0]
-    pair_b = pairs[1]
-    
     # 检查 pair_id 是否不同
     if pair_a.get('pair_id') == pair_b.get('pair_id'):
         return False, "两对的pair_id相同"
@@ -168,35 +172,39 @@ def validate_task3_pairs(pairs):
     return True, ""
 
 
+@lru_cache(maxsize=8192)
+def _clean_diagnosis(diag):
+    """转换为小写并去除首尾空格；同时返回去除标点后的版本 (结果按诊断缓存)"""
+    d = diag.lower().strip()
+    return d, _PUNCT_RE.sub('', d)
+
+
+@lru_cache(maxsize=8192)
 def diagnoses_are_same(diag1, diag2):
     """
     判断两个诊断是否相同
-    考虑到可能的大小写、空格等差异
+    考虑到可能的大小写、空格等差异 (结果按诊断对缓存)
     """
     if not diag1 or not diag2:
         return False
     
-    # 转换为小写并去除首尾空格
-    d1 = diag1.lower().strip()
-    d2 = diag2.lower().strip()
+    d1, d1_clean = _clean_diagnosis(diag1)
+    d2, d2_clean = _clean_diagnosis(diag2)
     
     # 完全相同
     if d1 == d2:
         return True
     
     # 去除标点符号后比较
-    import re
-    d1_clean = re.sub(r'[^\w\s]', '', d1)
-    d2_clean = re.sub(r'[^\w\s]', '', d2)
-    
     if d1_clean == d2_clean:
         return True
     
-    # 检查是否一个包含另一个（且长度相近）
-    if d1 in d2 or d2 in d1:
-        len_ratio = min(len(d1), len(d2)) / max(len(d1), len(d2))
-        if len_ratio > 0.8:  # 长度相差不超过20%
-            return True
+    # 检查是否一个包含另一个（且长度相近）：先比较长度，长度相差超过20%时不必做子串查找
+    l1, l2 = len(d1), len(d2)
+    if l1 > l2:
+        l1, l2 = l2, l1
+    if 5 * l1 > 4 * l2 and (d1 in d2 or d2 in d1):  # 即 短/长 > 0.8
+        return True
     
     return False
 
@@ -270,4 +278,4 @@ if __name__ == "__main__":
     # 显示第一个有效病例
     if valid_cases:
         print("\n第一个有效病例示例:")
-        print(json.dumps(valid_cases[0], ensure_ascii=False, indent=2)[:500] + "...")
\ No newline at end of file
+        print(dumps_json(valid_cases[0]).decode('utf-8')[:500] + "...")
\ No newline at end of file
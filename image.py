@@ -1,9 +1,48 @@
-import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def move_images_from_json(json_file_path, source_dir, target_dir):
+from json_io import iter_json_items
+
+
+_copy_file_range = getattr(os, 'copy_file_range', None)
+
+
+def copy_image(source_file, target_file):
+    """
+    复制单个图片文件的内容 (不复制元数据)
+    Linux 上用 os.copy_file_range 在内核中完成复制，支持 reflink 的文件系统 (Btrfs/XFS)
+    上几乎不耗时；其他平台或系统调用不可用时回退到 shutil.copyfile / copyfileobj
+    """
+    if _copy_file_range is None:
+        shutil.copyfile(source_file, target_file)
+        return
+    with open(source_file, 'rb') as fsrc:
+        src_stat = os.fstat(fsrc.fileno())
+        # 先不截断地打开目标文件，确认不是源文件本身后再截断
+        dst_fd = os.open(target_file, os.O_WRONLY | os.O_CREAT, 0o666)
+        with open(dst_fd, 'wb') as fdst:
+            dst_stat = os.fstat(dst_fd)
+            if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+                raise shutil.SameFileError(f"{source_file!r} and {target_file!r} are the same file")
+            os.ftruncate(dst_fd, 0)
+            remaining = src_stat.st_size
+            try:
+                while remaining > 0:
+                    copied = _copy_file_range(fsrc.fileno(), dst_fd, remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError:
+                # 旧内核跨文件系统或文件系统不支持时，从头用普通读写复制
+                fsrc.seek(0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+                shutil.copyfileobj(fsrc, fdst)
+
+
+def move_images_from_json(json_file_path, source_dir, target_dir, workers=None):
     """
     根据JSON文件中的图片路径，将图片从源目录复制到目标目录
     
@@ -11,12 +50,13 @@ def move_images_from_json(json_file_path, source_dir, target_dir):
         json_file_path: JSON文件路径
         source_dir: 源图片目录 (E:\medical\scin\images)
         target_dir: 目标目录
+        workers: 并发复制的线程数，默认 min(32, CPU数*4)
     """
     
-    # 读取JSON文件
+    # 读取JSON文件：每个案例只保留 id 和 image_paths，不在内存中保留 prompt 等大字段
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        cases = [(case.get('id', 'unknown'), case.get('image_paths', []))
+                 for case in iter_json_items(json_file_path)]
         print(f"成功读取JSON文件: {json_file_path}")
     except Exception as e:
         print(f"读取JSON文件失败: {e}")
@@ -31,11 +71,19 @@ def move_images_from_json(json_file_path, source_dir, target_dir):
     copied_images = 0
     missing_images = []
     
+    # 所有源文件都在 source_dir 下：读取一次目录列表，代替逐张图片 stat
+    try:
+        with os.scandir(source_dir) as entries:
+            source_names = {entry.name for entry in entries}
+    except OSError:
+        source_names = set()
+    
+    # 待复制的文件: 目标路径 -> (源路径, [(文件名, 案例ID), ...])
+    # 同一张图片被多个案例引用时只复制一次，避免多个线程同时写同一个文件
+    copy_jobs = {}
+    
     # 遍历JSON数据
-    for case in data:
-        case_id = case.get('id', 'unknown')
-        image_paths = case.get('image_paths', [])
-        
+    for case_id, image_paths in cases:
         for img_path in image_paths:
             total_images += 1
             
@@ -49,19 +97,36 @@ def move_images_from_json(json_file_path, source_dir, target_dir):
             # 构建目标文件完整路径
             target_file = os.path.join(target_dir, img_filename)
             
-            # 检查源文件是否存在
-            if os.path.exists(source_file):
-                try:
-                    # 复制文件到目标目录
-                    shutil.copy2(source_file, target_file)
-                    copied_images += 1
-                    print(f"✓ 已复制: {img_filename} (案例: {case_id})")
-                except Exception as e:
-                    print(f"✗ 复制失败 {img_filename}: {e}")
+            # 检查源文件是否存在 (目录列表中找不到时再 stat 一次，兼容大小写不敏感的文件系统)
+            if img_filename in source_names or os.path.exists(source_file):
+                copy_jobs.setdefault(target_file, (source_file, []))[1].append((img_filename, case_id))
             else:
                 missing_images.append(img_filename)
                 print(f"✗ 文件不存在: {img_filename} (案例: {case_id})")
     
+    # 复制文件是 I/O 密集型操作，用线程池并发复制
+    # 只需要文件内容：copy_image 不复制元数据，且走 copy_file_range / sendfile 等内核快速路径
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) * 4)
+    # 成功的复制不再逐张输出，约每完成 1% 打印一次进度；失败仍逐个输出
+    total_jobs = len(copy_jobs)
+    progress_every = max(1, total_jobs // 100)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(copy_image, source_file, target_file): refs
+            for target_file, (source_file, refs) in copy_jobs.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            refs = futures[future]
+            try:
+                future.result()
+                copied_images += len(refs)
+            except Exception as e:
+                for img_filename, _ in refs:
+                    print(f"✗ 复制失败 {img_filename}: {e}")
+            if done % progress_every == 0 or done == total_jobs:
+                print(f"复制进度: {done}/{total_jobs} ({done/total_jobs*100:.1f}%)")
+    
     # 打印统计信息
     print("\n" + "="*50)
     print("处理完成!")
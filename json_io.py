@@ -0,0 +1,68 @@
+"""
+各脚本共用的JSON读写工具
+
+安装了 orjson 时用它解析/序列化，否则回退到标准库 json；
+安装了 ijson 时可流式逐条读取数组元素，否则整体读取后再遍历。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # 未安装 ijson 时整体读取JSON文件
+    ijson = None
+
+# 是否支持流式读取 (调用方可据此选择更省内存的处理方式)
+HAS_IJSON = ijson is not None
+
+
+def load_json(path):
+    """读取JSON文件，优先使用 orjson 解析"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dumps_json(obj, pretty=True) -> bytes:
+    """
+    序列化为UTF-8字节串 (保留非ASCII字符)
+    pretty=True 时为 2 空格缩进，缩进和换行与 json.dumps(..., ensure_ascii=False, indent=2) 相同；
+    使用 orjson 时浮点数的写法可能不同 (如 1e-05 写作 0.00001，1e+16 写作 1e16)，数值不变
+    pretty=False 时输出不带空白的紧凑JSON
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dump_json(obj, path, pretty=True) -> None:
+    """写出JSON文件，格式见 dumps_json"""
+    with open(path, 'wb') as f:
+        f.write(dumps_json(obj, pretty=pretty))
+
+
+def iter_json_items(path, prefix='item'):
+    """
+    逐条读取JSON文件中 prefix 指向的数组元素 (ijson 前缀语法)
+    例如 'item' 为顶层数组，'per_sample_results.item' 为顶层对象中 per_sample_results 数组；
+    安装了 ijson 时流式解析，不会一次性载入整个文档
+    """
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, prefix, use_float=True)
+        return
+    data = load_json(path)
+    for key in prefix.split('.')[:-1]:
+        data = data.get(key, [])
+    yield from data
@@ -0,0 +1,104 @@
+"""
+核对 match_case_by_gt 的倒排索引筛选：与逐条比较全部条目 (use_index=False) 的结果必须完全一致
+
+运行: python -m unittest test_match_case_by_gt
+"""
+import json
+import os
+import random
+import unittest
+
+from data_process import (
+    _candidate_positions,
+    diagnoses_match,
+    match_case_by_gt,
+    normalize_diagnosis,
+    prepare_medical_gt,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+VOCAB = ['acne', 'eczema', 'psoriasis', 'vulgaris', 'contact', 'dermatitis', 'tinea', 'corporis',
+         'urticaria', 'lichen', 'planus', 'seborrheic', 'keratosis', 'melanoma', 'nevus', 'rosacea']
+
+
+def _medical(*gt_lists):
+    """由若干GT列表构造 medical_data 条目"""
+    return [{'id': f'med_{i}', 'GT': {f'label_{j + 1}': gt for j, gt in enumerate(gts)}}
+            for i, gts in enumerate(gt_lists)]
+
+
+def _random_diagnosis(rng):
+    return ' '.join(rng.sample(VOCAB, rng.randint(1, 3)))
+
+
+class MatchCaseByGtIndexTest(unittest.TestCase):
+
+    def assert_same_match(self, case_eval, medical_data):
+        medical_gt = prepare_medical_gt(medical_data)
+        indexed = match_case_by_gt(case_eval, medical_data, medical_gt=medical_gt)
+        full = match_case_by_gt(case_eval, medical_data, medical_gt=medical_gt, use_index=False)
+        self.assertIs(indexed, full, case_eval)
+        return indexed
+
+    def test_exact_match(self):
+        medical_data = _medical(['Eczema'], ['Psoriasis', 'Acne vulgaris'], ['Tinea corporis'])
+        matched = self.assert_same_match(
+            {'ground_truth_differential': ['Psoriasis', 'Acne vulgaris']}, medical_data)
+        self.assertIs(matched, medical_data[1])
+
+    def test_short_diagnoses(self):
+        # 少于3个字符的GT无法由三元组覆盖：评估侧回退为全量比较，medical 侧始终作为候选
+        medical_data = _medical(['MF'], ['Acne'], ['AK', 'Actinic keratosis'])
+        for gts in (['MF'], ['AK'], ['Acne'], ['AK', 'Actinic keratosis'], ['ak.']):
+            self.assert_same_match({'ground_truth_differential': gts}, medical_data)
+
+    def test_no_candidates(self):
+        medical_data = _medical(['Eczema'], ['Psoriasis'])
+        case_eval = {'ground_truth_differential': ['Urticaria pigmentosa']}
+        medical_gt = prepare_medical_gt(medical_data)
+        eval_gt = [normalize_diagnosis(gt) for gt in case_eval['ground_truth_differential']]
+        self.assertEqual(_candidate_positions(eval_gt, medical_gt), set())
+        self.assertIsNone(self.assert_same_match(case_eval, medical_data))
+
+    def test_containment_and_word_order(self):
+        medical_data = _medical(['Allergic contact dermatitis'], ['Dermatitis contact'],
+                                ['Seborrheic keratosis'], ['Lichen planus'])
+        for gts in (['Contact dermatitis'], ['Allergic contact dermatitis of the hand'],
+                    ['keratosis seborrheic'], ['Lichen planus', 'Eczema'], ['']):
+            self.assert_same_match({'ground_truth_differential': gts}, medical_data)
+
+    def test_candidates_cover_every_match(self):
+        # 候选集合必须包含所有与评估GT匹配的条目
+        rng = random.Random(0)
+        medical_data = _medical(*[[_random_diagnosis(rng) for _ in range(rng.randint(1, 3))]
+                                  for _ in range(200)])
+        medical_gt = prepare_medical_gt(medical_data)
+        for _ in range(300):
+            eval_gt = [normalize_diagnosis(_random_diagnosis(rng)) for _ in range(rng.randint(1, 3))]
+            candidates = _candidate_positions(eval_gt, medical_gt)
+            if candidates is None:
+                continue
+            for pos, (_, med_gt) in enumerate(medical_gt['entries']):
+                if any(diagnoses_match(e, m) for e in eval_gt for m in med_gt):
+                    self.assertIn(pos, candidates, (eval_gt, med_gt))
+            case_eval = {'ground_truth_differential': eval_gt}
+            self.assertIs(match_case_by_gt(case_eval, medical_data, medical_gt=medical_gt),
+                          match_case_by_gt(case_eval, medical_data, medical_gt=medical_gt, use_index=False))
+
+    @unittest.skipUnless(os.path.exists(os.path.join(HERE, 'scin_dd_evaluation.json'))
+                         and os.path.exists(os.path.join(HERE, 'SCIN_DD_input.json')),
+                         '缺少样例数据文件')
+    def test_sample_data(self):
+        with open(os.path.join(HERE, 'scin_dd_evaluation.json'), encoding='utf-8') as f:
+            samples = json.load(f)['per_sample_results']
+        with open(os.path.join(HERE, 'SCIN_DD_input.json'), encoding='utf-8') as f:
+            medical_data = json.load(f)
+        medical_gt = prepare_medical_gt(medical_data)
+        for sample in samples[::max(1, len(samples) // 40)][:40]:
+            self.assertIs(match_case_by_gt(sample, medical_data, medical_gt=medical_gt),
+                          match_case_by_gt(sample, medical_data, medical_gt=medical_gt, use_index=False))
+
+
+if __name__ == '__main__':
+    unittest.main()